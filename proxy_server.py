@@ -3,285 +3,643 @@
 """
 Simple HTTP proxy server for NSE APIs to bypass CORS restrictions.
 This server acts as a proxy between the frontend and NSE APIs.
+
+Runs on aiohttp so that concurrent requests are served from a single event
+loop while upstream NSE calls are in flight. Requires: pip install aiohttp orjson
 """
 
-import http.server
-import json
-import urllib.request
-import urllib.parse
-import urllib.error
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import asyncio
+import datetime
+import functools
+import hashlib
 import time
 import logging
+import logging.handlers
+import queue
+import random
+import urllib.parse
+import zlib
+
+import aiohttp
+import orjson
+from aiohttp import web
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-class NSEProxyHandler(BaseHTTPRequestHandler):
-    """HTTP request handler for NSE API proxy."""
-    
-    def __init__(self, *args, **kwargs):
-        self.nse_cookies = ""
-        self.last_cookie_update = 0
-        self.cookie_refresh_interval = 300  # 5 minutes
-        super().__init__(*args, **kwargs)
-    
-    def do_OPTIONS(self):
-        """Handle CORS preflight requests."""
-        self.send_cors_headers()
-        self.end_headers()
-    
-    def do_GET(self):
-        """Handle GET requests."""
-        try:
-            if self.path.startswith('/api/nse/quote'):
-                self.handle_stock_quote()
-            elif self.path.startswith('/api/nse/symbols'):
-                self.handle_symbols()
-            elif self.path.startswith('/api/nse/market-status'):
-                self.handle_market_status()
-            elif self.path.startswith('/api/nse/top-stocks'):
-                self.handle_top_stocks()
-            elif self.path.startswith('/api/health'):
-                self.handle_health()
-            else:
-                self.send_error(404, "Endpoint not found")
-        except Exception as e:
-            logger.error(f"Error handling request: {e}")
-            self.send_error(500, f"Internal server error: {str(e)}")
-    
-    def send_cors_headers(self):
-        """Send CORS headers."""
-        self.send_response(200)
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type, Accept')
-        self.send_header('Content-Type', 'application/json')
-    
-    def send_json_response(self, data, status_code=200):
-        """Send JSON response with CORS headers."""
-        self.send_cors_headers()
-        if status_code != 200:
-            self.send_response(status_code)
-        self.end_headers()
-        
-        response_json = json.dumps(data, indent=2)
-        self.wfile.write(response_json.encode('utf-8'))
-    
-    def get_nse_cookies(self):
-        """Get fresh NSE session cookies."""
-        try:
-            if not self.nse_cookies or (time.time() - self.last_cookie_update) > self.cookie_refresh_interval:
-                logger.info("🔄 Refreshing NSE session cookies...")
-                
-                req = urllib.request.Request(
-                    'https://www.nseindia.com/',
-                    headers={
-                        'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                        'Accept-Language': 'en-US,en;q=0.9',
-                        'DNT': '1',
-                        'Connection': 'keep-alive',
-                        'Upgrade-Insecure-Requests': '1',
-                    }
-                )
-                
-                with urllib.request.urlopen(req, timeout=10) as response:
-                    # Extract cookies from Set-Cookie headers
-                    set_cookies = response.headers.get_all('Set-Cookie') or []
-                    self.nse_cookies = '; '.join([cookie.split(';')[0] for cookie in set_cookies])
-                    self.last_cookie_update = time.time()
-                    logger.info("✅ NSE cookies refreshed successfully")
-                    
-        except Exception as e:
-            logger.error(f"❌ Failed to refresh NSE cookies: {e}")
-    
-    def make_nse_request(self, url):
-        """Make a request to NSE API with proper headers."""
+
+def configure_logging():
+    """Route log records through a queue so handlers never block on stderr.
+
+    Returns the started listener; the caller stops it on shutdown.
+    """
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    return listener
+
+
+COOKIE_REFRESH_INTERVAL = 300  # 5 minutes
+COOKIE_REFRESH_JITTER = 0.1  # +/-10% so proxy instances don't refresh in lockstep
+
+# A single 403/451 is often transient; only drop the cookies after this
+# many auth errors in a row
+AUTH_FAILURES_BEFORE_REFRESH = 2
+
+# All upstream traffic goes to www.nseindia.com, so keep connections alive
+# and reuse them instead of paying a TCP + TLS handshake per request
+CONNECTION_POOL_LIMIT = 100
+CONNECTION_POOL_LIMIT_PER_HOST = 20
+KEEPALIVE_TIMEOUT = 60
+DNS_CACHE_TTL = 300
+
+NSE_USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# Headers for loading the NSE home page to obtain session cookies
+_NSE_BROWSE_HEADERS = {
+    'User-Agent': NSE_USER_AGENT,
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'DNT': '1',
+    'Connection': 'keep-alive',
+    'Upgrade-Insecure-Requests': '1',
+}
+
+# Headers for NSE API calls; only the Cookie header is added per request
+_NSE_API_HEADERS = {
+    'User-Agent': NSE_USER_AGENT,
+    'Accept': 'application/json,text/plain,*/*',
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Referer': 'https://www.nseindia.com/',
+    'DNT': '1',
+    'Connection': 'keep-alive',
+}
+
+# Seconds a successful response is served from memory before NSE is asked again
+RESPONSE_CACHE_TTLS = {
+    'symbols': 3600,
+    'market-status': 30,
+    'top-stocks': 15,
+    'quote': 5,
+}
+
+# Upper bound on symbols per batched quote request, and on quote fetches
+# in flight against NSE at any one time
+MAX_BATCH_QUOTES = 20
+MAX_CONCURRENT_QUOTE_FETCHES = 10
+
+# Cache key -> (expires at, encoded JSON body, ETag), oldest fill first.
+# Quote keys come from client-supplied symbols, so the cache is bounded.
+RESPONSE_CACHE: dict[str, tuple[float, bytes, str]] = {}
+RESPONSE_CACHE_MAX_ENTRIES = 1024
+
+# Cache key -> in-flight fetch shared by every request that missed on it
+_response_cache_fetches: dict[str, asyncio.Future] = {}
+
+# Fallback bodies are encoded once at import rather than on every failure
+FALLBACK_SYMBOLS = [
+    "RELIANCE", "TCS", "HDFCBANK", "INFY", "HINDUNILVR", "ICICIBANK", "KOTAKBANK",
+    "BHARTIARTL", "ITC", "SBIN", "LT", "ASIANPAINT", "AXISBANK", "MARUTI", "BAJFINANCE",
+    "HCLTECH", "DMART", "SUNPHARMA", "TITAN", "ULTRACEMCO", "NESTLEIND", "WIPRO",
+    "ADANIENT", "JSWSTEEL", "POWERGRID", "TATAMOTORS", "NTPC", "COALINDIA", "ONGC"
+]
+FALLBACK_SYMBOLS_BYTES = orjson.dumps({"symbols": FALLBACK_SYMBOLS})
+FALLBACK_TOP_STOCKS_BYTES = orjson.dumps({"stocks": []})
+
+# (second, cookie update time, cookies set) -> encoded health body
+_health_cache = (None, b'')
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type, Accept',
+}
+
+
+class NSESession:
+    """NSE session cookies shared by every inbound request."""
+
+    def __init__(self):
+        self.cookies = ""
+        self.last_update = 0.0
+        self.refresh_interval = COOKIE_REFRESH_INTERVAL
+        self.auth_failures = 0
+        self.refresh_attempts = 0  # completed refreshes, successful or not
+        self.lock = asyncio.Lock()
+
+    def is_valid(self):
+        """Whether the current cookies are set and still within their TTL."""
+        return bool(self.cookies) and (time.time() - self.last_update) < self.refresh_interval
+
+
+nse_session = NSESession()
+_quote_fetch_semaphore = asyncio.Semaphore(MAX_CONCURRENT_QUOTE_FETCHES)
+
+
+@web.middleware
+async def cors_middleware(request, handler):
+    """Answer CORS preflight requests and add CORS headers to every response."""
+    if request.method == 'OPTIONS':
+        response = web.Response(content_type='application/json')
+    else:
         try:
-            self.get_nse_cookies()
-            
-            logger.info(f"📡 Making NSE request: {url}")
-            
-            req = urllib.request.Request(
-                url,
-                headers={
-                    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-                    'Accept': 'application/json,text/plain,*/*',
-                    'Accept-Language': 'en-US,en;q=0.9',
-                    'Referer': 'https://www.nseindia.com/',
-                    'DNT': '1',
-                    'Connection': 'keep-alive',
-                    'Cookie': self.nse_cookies,
-                }
-            )
-            
-            with urllib.request.urlopen(req, timeout=15) as response:
-                data = json.loads(response.read().decode('utf-8'))
-                logger.info(f"✅ NSE request successful: {url}")
-                return data
-                
-        except urllib.error.HTTPError as e:
-            logger.error(f"❌ NSE HTTP error {e.code}: {e.reason}")
-            if e.code in [403, 451]:
-                # Try refreshing cookies on auth errors
-                self.nse_cookies = ""
-                logger.info("🔄 Refreshing cookies due to auth error...")
+            response = await handler(request)
+        except web.HTTPException as e:
+            # Re-raise so aiohttp renders it as a normal, sized response
+            e.headers.update(CORS_HEADERS)
             raise
         except Exception as e:
-            logger.error(f"❌ NSE request error: {e}")
-            raise
-    
-    def handle_stock_quote(self):
-        """Handle stock quote requests."""
-        # Parse query parameters
-        parsed_url = urllib.parse.urlparse(self.path)
-        params = urllib.parse.parse_qs(parsed_url.query)
-        symbol = params.get('symbol', [None])[0]
-        
-        if not symbol:
-            self.send_json_response({"error": "symbol parameter is required"}, 400)
+            logger.error("Error handling request: %s", e)
+            response = json_response({"error": f"Internal server error: {str(e)}"}, status=500)
+    response.headers.update(CORS_HEADERS)
+    return response
+
+
+async def get_nse_cookies(app):
+    """Get fresh NSE session cookies."""
+    if nse_session.is_valid():
+        return
+
+    attempts = nse_session.refresh_attempts
+    async with nse_session.lock:
+        # If another request refreshed while we waited, share its result
+        # (even a failed one) instead of hitting NSE again
+        if nse_session.is_valid() or nse_session.refresh_attempts != attempts:
             return
-        
-        symbol = symbol.upper().replace('.NS', '')  # Remove .NS suffix if present
-        logger.info(f"📊 Fetching quote for: {symbol}")
-        
-        try:
-            # Try to get stock quote from NSE
-            url = f"https://www.nseindia.com/api/quote-equity?symbol={urllib.parse.quote(symbol)}"
-            data = self.make_nse_request(url)
-            self.send_json_response(data)
-            
-        except Exception as e:
-            logger.error(f"Failed to fetch quote for {symbol}: {e}")
-            # Return fallback data
-            fallback_data = {
-                "symbol": symbol,
-                "companyName": f"{symbol} Limited",
-                "lastPrice": 1000.0 + hash(symbol) % 1000,
-                "change": (hash(symbol) % 100) - 50,
-                "pChange": ((hash(symbol) % 100) - 50) / 10,
-                "totalTradedVolume": hash(symbol) % 1000000 + 100000
-            }
-            self.send_json_response(fallback_data)
-    
-    def handle_symbols(self):
-        """Handle symbols list requests."""
-        logger.info("📋 Fetching NSE symbols...")
-        
-        try:
-            # Try to get symbols from NSE F&O list
-            url = "https://www.nseindia.com/api/equity-stockIndices?index=SECURITIES%20IN%20F%26O"
-            data = self.make_nse_request(url)
-            
-            if 'data' in data and isinstance(data['data'], list):
-                symbols = [item['symbol'] for item in data['data'] if 'symbol' in item]
-                self.send_json_response({"symbols": symbols[:500]})  # Limit to 500
-            else:
-                raise Exception("Invalid response format")
-                
-        except Exception as e:
-            logger.error(f"Failed to fetch symbols: {e}")
-            # Return fallback symbols
-            fallback_symbols = [
-                "RELIANCE", "TCS", "HDFCBANK", "INFY", "HINDUNILVR", "ICICIBANK", "KOTAKBANK",
-                "BHARTIARTL", "ITC", "SBIN", "LT", "ASIANPAINT", "AXISBANK", "MARUTI", "BAJFINANCE",
-                "HCLTECH", "DMART", "SUNPHARMA", "TITAN", "ULTRACEMCO", "NESTLEIND", "WIPRO",
-                "ADANIENT", "JSWSTEEL", "POWERGRID", "TATAMOTORS", "NTPC", "COALINDIA", "ONGC"
-            ]
-            self.send_json_response({"symbols": fallback_symbols})
-    
-    def handle_market_status(self):
-        """Handle market status requests."""
-        logger.info("🏛️  Fetching market status...")
-        
+
         try:
-            url = "https://www.nseindia.com/api/marketStatus"
-            data = self.make_nse_request(url)
-            self.send_json_response(data)
-            
+            logger.info("🔄 Refreshing NSE session cookies...")
+
+            async with app['session'].get(
+                'https://www.nseindia.com/',
+                headers=_NSE_BROWSE_HEADERS,
+                timeout=aiohttp.ClientTimeout(total=10),
+            ) as response:
+                # A blocked or failed home page must not count as a refresh
+                response.raise_for_status()
+
+                # Extract cookies from Set-Cookie headers
+                set_cookies = response.headers.getall('Set-Cookie', [])
+                nse_session.cookies = '; '.join(cookie.partition(';')[0] for cookie in set_cookies)
+                nse_session.last_update = time.time()
+                nse_session.refresh_interval = COOKIE_REFRESH_INTERVAL * (
+                    1 + random.uniform(-COOKIE_REFRESH_JITTER, COOKIE_REFRESH_JITTER)
+                )
+                logger.info("✅ NSE cookies refreshed successfully")
+
         except Exception as e:
-            logger.error(f"Failed to fetch market status: {e}")
-            # Return fallback status
-            import datetime
-            
-            now = datetime.datetime.now()
-            ist_now = now + datetime.timedelta(hours=5, minutes=30)  # Convert to IST
-            hour = ist_now.hour
-            day = ist_now.weekday()  # 0=Monday, 6=Sunday
-            
-            # Market is open Monday-Friday 9:15 AM to 3:30 PM IST
-            is_market_hours = 0 <= day <= 4 and 9 <= hour < 16
-            
-            fallback_status = {
-                "marketState": [{
-                    "market": "Capital Market",
-                    "marketStatus": "Open" if is_market_hours else "Closed",
-                    "tradeDate": ist_now.strftime("%Y-%m-%d"),
-                    "index": "NIFTY 50"
-                }]
+            logger.error("❌ Failed to refresh NSE cookies: %s", e)
+        finally:
+            nse_session.refresh_attempts += 1
+
+
+async def make_nse_request(app, url):
+    """Make a request to NSE API with proper headers.
+
+    Returns the raw JSON body so pass-through endpoints can forward it
+    without decoding and re-encoding it.
+    """
+    try:
+        await get_nse_cookies(app)
+
+        logger.info("📡 Making NSE request: %s", url)
+
+        # Send no Cookie header at all rather than an empty one
+        headers = _NSE_API_HEADERS
+        if nse_session.cookies:
+            headers = {**_NSE_API_HEADERS, 'Cookie': nse_session.cookies}
+
+        async with app['session'].get(
+            url,
+            headers=headers,
+            timeout=aiohttp.ClientTimeout(total=15),
+        ) as response:
+            response.raise_for_status()
+            if 'json' not in response.content_type:
+                raise Exception(f"Unexpected content type: {response.content_type}")
+            body = await response.read()
+            nse_session.auth_failures = 0
+            logger.info("✅ NSE request successful: %s", url)
+            return body
+
+    except aiohttp.ClientResponseError as e:
+        logger.error("❌ NSE HTTP error %s: %s", e.status, e.message)
+        if e.status in [403, 451]:
+            # Try refreshing cookies once auth errors persist; other errors
+            # (5xx, timeouts) say nothing about the cookies and keep them
+            nse_session.auth_failures += 1
+            if nse_session.auth_failures >= AUTH_FAILURES_BEFORE_REFRESH:
+                # NSESession is the only cookie source (no client jar), so
+                # clearing it stops the rejected cookies going out at all
+                nse_session.cookies = ""
+                nse_session.auth_failures = 0
+                logger.info("🔄 Refreshing cookies due to auth error...")
+        raise
+    except Exception as e:
+        logger.error("❌ NSE request error: %s", e)
+        raise
+
+
+def checked_json_body(body):
+    """Return body unchanged if it is a complete JSON document.
+
+    Pass-through endpoints forward and cache NSE bodies verbatim, so an empty
+    or truncated body must raise here and send the caller to its fallback.
+    This runs on cache fills only, at most once per TTL.
+    """
+    orjson.loads(body)
+    return body
+
+
+async def cached_response(key, ttl, fetch):
+    """Return (JSON body, ETag) for key, awaiting fetch() for the body on a miss.
+
+    Concurrent misses for the same key share a single fetch and its outcome:
+    if it fails, every waiter gets the same exception at once and falls back,
+    rather than retrying NSE one after another. Failed fetches are not
+    cached, so NSE is retried on the next request.
+    """
+    entry = RESPONSE_CACHE.get(key)
+    if entry and time.time() < entry[0]:
+        return entry[1], entry[2]
+
+    task = _response_cache_fetches.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_fill_response_cache(key, ttl, fetch))
+        _response_cache_fetches[key] = task
+        task.add_done_callback(functools.partial(_finish_response_cache_fetch, key))
+
+    # Shield the shared fetch so one client disconnecting doesn't cancel it
+    # for everyone else waiting on it
+    return await asyncio.shield(task)
+
+
+async def _fill_response_cache(key, ttl, fetch):
+    """Fetch the body for key and store it in RESPONSE_CACHE."""
+    body = await fetch()
+    etag = make_etag(body)
+
+    if len(RESPONSE_CACHE) >= RESPONSE_CACHE_MAX_ENTRIES:
+        _prune_response_cache()
+    # Re-insert so dict order stays oldest fill first
+    RESPONSE_CACHE.pop(key, None)
+    RESPONSE_CACHE[key] = (time.time() + ttl, body, etag)
+    return body, etag
+
+
+def _finish_response_cache_fetch(key, task):
+    """Forget a finished shared fetch."""
+    _response_cache_fetches.pop(key, None)
+    if not task.cancelled():
+        # Mark the exception retrieved in case every waiter went away
+        task.exception()
+
+
+def _prune_response_cache():
+    """Drop expired entries, then the oldest ones if the cache is still full."""
+    now = time.time()
+    for key in [key for key, entry in RESPONSE_CACHE.items() if now >= entry[0]]:
+        del RESPONSE_CACHE[key]
+
+    excess = len(RESPONSE_CACHE) - RESPONSE_CACHE_MAX_ENTRIES * 3 // 4
+    if excess > 0:
+        for key in list(RESPONSE_CACHE)[:excess]:
+            del RESPONSE_CACHE[key]
+
+
+def make_etag(body):
+    """Strong ETag for an encoded response body."""
+    return f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+
+
+def json_body_response(body, status=200):
+    """Build a JSON response from an already encoded body."""
+    return web.Response(body=body, status=status, content_type='application/json')
+
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison of an If-None-Match header against etag (RFC 9110 13.1.2).
+
+    Tags may arrive weakened (W/"..."), e.g. after a gzipping proxy.
+    """
+    if if_none_match.strip() == '*':
+        return True
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+
+def etag_response(request, body, etag):
+    """Build a JSON response carrying etag, or a 304 if the client already has it."""
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and etag_matches(if_none_match, etag):
+        return web.Response(status=304, headers={'ETag': etag})
+
+    response = json_body_response(body)
+    response.headers['ETag'] = etag
+    return response
+
+
+def json_response(data, status=200):
+    """Build a compact JSON response."""
+    return json_body_response(orjson.dumps(data), status)
+
+
+@functools.lru_cache(maxsize=2048)
+def normalize_symbol(symbol):
+    """Upper-case a symbol and strip any .NS suffix."""
+    symbol = symbol.upper()
+    return symbol[:-3] if symbol.endswith('.NS') else symbol
+
+
+@functools.lru_cache(maxsize=1024)
+def build_fallback_quote(symbol):
+    """Encoded placeholder quote for a symbol NSE could not be reached for.
+
+    Seeded with crc32 rather than hash() so a symbol gets the same numbers
+    across restarts regardless of PYTHONHASHSEED.
+    """
+    seed = zlib.crc32(symbol.encode('utf-8'))
+    return orjson.dumps({
+        "symbol": symbol,
+        "companyName": f"{symbol} Limited",
+        "lastPrice": 1000.0 + seed % 1000,
+        "change": (seed % 100) - 50,
+        "pChange": ((seed % 100) - 50) / 10,
+        "totalTradedVolume": seed % 1000000 + 100000
+    })
+
+
+@functools.lru_cache(maxsize=2048)
+def quote_url(symbol):
+    """NSE quote URL for a normalized symbol."""
+    return f"https://www.nseindia.com/api/quote-equity?symbol={urllib.parse.quote(symbol)}"
+
+
+async def fetch_stock_quote(app, symbol):
+    """Fetch the NSE quote for a normalized symbol."""
+    url = quote_url(symbol)
+    async with _quote_fetch_semaphore:
+        return checked_json_body(await make_nse_request(app, url))
+
+
+async def cached_stock_quote(app, symbol):
+    """Return (encoded NSE quote, ETag) for a normalized symbol."""
+    return await cached_response(
+        f"quote:{symbol}", RESPONSE_CACHE_TTLS['quote'],
+        lambda: fetch_stock_quote(app, symbol),
+    )
+
+
+async def fetch_symbols(app):
+    """Fetch the NSE F&O symbol list."""
+    url = "https://www.nseindia.com/api/equity-stockIndices?index=SECURITIES%20IN%20F%26O"
+    data = orjson.loads(await make_nse_request(app, url))
+
+    if 'data' in data and isinstance(data['data'], list):
+        symbols = [item['symbol'] for item in data['data'] if 'symbol' in item]
+        return orjson.dumps({"symbols": symbols[:500]})  # Limit to 500
+    else:
+        raise Exception("Invalid response format")
+
+
+async def fetch_market_status(app):
+    """Fetch the NSE market status."""
+    url = "https://www.nseindia.com/api/marketStatus"
+    return checked_json_body(await make_nse_request(app, url))
+
+
+async def fetch_top_stocks(app):
+    """Fetch the NIFTY 50 constituents projected to the frontend stock shape."""
+    url = "https://www.nseindia.com/api/equity-stockIndices?index=NIFTY%2050"
+    data = orjson.loads(await make_nse_request(app, url))
+
+    if 'data' in data and isinstance(data['data'], list):
+        stocks = []
+        for item in data['data'][:20]:  # Take top 20
+            stock = {
+                "symbol": item.get('symbol', ''),
+                "name": item.get('companyName', item.get('symbol', '')),
+                "price": item.get('lastPrice', 0),
+                "change": item.get('change', 0),
+                "changePercent": item.get('pChange', 0),
+                "volume": item.get('totalTradedVolume', 0),
+                "marketCap": item.get('meta', {}).get('companyName', 'N/A')
             }
-            self.send_json_response(fallback_status)
-    
-    def handle_top_stocks(self):
-        """Handle top stocks requests."""
-        logger.info("📈 Fetching top stocks...")
-        
-        try:
-            url = "https://www.nseindia.com/api/equity-stockIndices?index=NIFTY%2050"
-            data = self.make_nse_request(url)
-            
-            if 'data' in data and isinstance(data['data'], list):
-                stocks = []
-                for item in data['data'][:20]:  # Take top 20
-                    stock = {
-                        "symbol": item.get('symbol', ''),
-                        "name": item.get('companyName', item.get('symbol', '')),
-                        "price": item.get('lastPrice', 0),
-                        "change": item.get('change', 0),
-                        "changePercent": item.get('pChange', 0),
-                        "volume": item.get('totalTradedVolume', 0),
-                        "marketCap": item.get('meta', {}).get('companyName', 'N/A')
-                    }
-                    stocks.append(stock)
-                
-                self.send_json_response({"stocks": stocks})
-            else:
-                raise Exception("Invalid response format")
-                
-        except Exception as e:
-            logger.error(f"Failed to fetch top stocks: {e}")
-            self.send_json_response({"stocks": []})
-    
-    def handle_health(self):
-        """Handle health check requests."""
+            stocks.append(stock)
+
+        return orjson.dumps({"stocks": stocks})
+    else:
+        raise Exception("Invalid response format")
+
+
+async def handle_stock_quote(request):
+    """Handle stock quote requests."""
+    symbol = request.query.get('symbol')
+
+    if not symbol:
+        return json_response({"error": "symbol parameter is required"}, status=400)
+
+    symbol = normalize_symbol(symbol)
+    logger.info("📊 Fetching quote for: %s", symbol)
+
+    try:
+        # Try to get stock quote from NSE
+        body, etag = await cached_stock_quote(request.app, symbol)
+        return etag_response(request, body, etag)
+
+    except Exception as e:
+        logger.error("Failed to fetch quote for %s: %s", symbol, e)
+        # Return fallback data
+        return json_body_response(build_fallback_quote(symbol))
+
+
+async def handle_stock_quotes(request):
+    """Handle batched stock quote requests (?symbols=A,B,C)."""
+    param = request.query.get('symbols')
+
+    if not param:
+        return json_response({"error": "symbols parameter is required"}, status=400)
+
+    symbols = list(dict.fromkeys(
+        normalize_symbol(symbol.strip()) for symbol in param.split(',') if symbol.strip()
+    ))[:MAX_BATCH_QUOTES]
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("📊 Fetching quotes for: %s", ', '.join(symbols))
+
+    # Fetch all quotes concurrently; the total time is that of the slowest one
+    results = await asyncio.gather(
+        *[cached_stock_quote(request.app, symbol) for symbol in symbols],
+        return_exceptions=True,
+    )
+
+    quotes = []
+    failed = []
+    for symbol, result in zip(symbols, results):
+        if isinstance(result, Exception):
+            logger.error("Failed to fetch quote for %s: %s", symbol, result)
+            failed.append(symbol)
+        else:
+            # Splice the cached bodies in directly rather than decoding them
+            quotes.append(orjson.dumps(symbol) + b':' + result[0])
+
+    body = b'{"quotes":{' + b','.join(quotes) + b'},"failed":' + orjson.dumps(failed) + b'}'
+    return etag_response(request, body, make_etag(body))
+
+
+async def handle_symbols(request):
+    """Handle symbols list requests."""
+    logger.info("📋 Fetching NSE symbols...")
+
+    try:
+        # Try to get symbols from NSE F&O list
+        body, etag = await cached_response(
+            'symbols', RESPONSE_CACHE_TTLS['symbols'],
+            lambda: fetch_symbols(request.app),
+        )
+        return etag_response(request, body, etag)
+
+    except Exception as e:
+        logger.error("Failed to fetch symbols: %s", e)
+        # Return fallback symbols
+        return json_body_response(FALLBACK_SYMBOLS_BYTES)
+
+
+async def handle_market_status(request):
+    """Handle market status requests."""
+    logger.info("🏛️  Fetching market status...")
+
+    try:
+        body, etag = await cached_response(
+            'market-status', RESPONSE_CACHE_TTLS['market-status'],
+            lambda: fetch_market_status(request.app),
+        )
+        return etag_response(request, body, etag)
+
+    except Exception as e:
+        logger.error("Failed to fetch market status: %s", e)
+        # Return fallback status
+        now = datetime.datetime.now()
+        ist_now = now + datetime.timedelta(hours=5, minutes=30)  # Convert to IST
+        hour = ist_now.hour
+        day = ist_now.weekday()  # 0=Monday, 6=Sunday
+
+        # Market is open Monday-Friday 9:15 AM to 3:30 PM IST
+        is_market_hours = 0 <= day <= 4 and 9 <= hour < 16
+
+        fallback_status = {
+            "marketState": [{
+                "market": "Capital Market",
+                "marketStatus": "Open" if is_market_hours else "Closed",
+                "tradeDate": ist_now.strftime("%Y-%m-%d"),
+                "index": "NIFTY 50"
+            }]
+        }
+        return json_response(fallback_status)
+
+
+async def handle_top_stocks(request):
+    """Handle top stocks requests."""
+    logger.info("📈 Fetching top stocks...")
+
+    try:
+        body, etag = await cached_response(
+            'top-stocks', RESPONSE_CACHE_TTLS['top-stocks'],
+            lambda: fetch_top_stocks(request.app),
+        )
+        return etag_response(request, body, etag)
+
+    except Exception as e:
+        logger.error("Failed to fetch top stocks: %s", e)
+        return json_body_response(FALLBACK_TOP_STOCKS_BYTES)
+
+
+async def handle_health(request):
+    """Handle health check requests."""
+    global _health_cache
+
+    # Probes arrive far more often than once a second, so the body is only
+    # rebuilt when the second or the cookie state changes
+    now = int(time.time())
+    key = (now, nse_session.last_update, bool(nse_session.cookies))
+    if _health_cache[0] != key:
         health_status = {
             "status": "ok",
-            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
-            "cookiesLastUpdated": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.last_cookie_update)) if self.last_cookie_update else None,
-            "cookiesValid": bool(self.nse_cookies and (time.time() - self.last_cookie_update) < self.cookie_refresh_interval)
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(now)),
+            "cookiesLastUpdated": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(nse_session.last_update)) if nse_session.last_update else None,
+            "cookiesValid": nse_session.is_valid()
         }
-        self.send_json_response(health_status)
+        _health_cache = (key, orjson.dumps(health_status))
+
+    return json_body_response(_health_cache[1])
+
+
+async def on_startup(app):
+    """Create the shared upstream client session and its connection pool."""
+    connector = aiohttp.TCPConnector(
+        limit=CONNECTION_POOL_LIMIT,
+        limit_per_host=CONNECTION_POOL_LIMIT_PER_HOST,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=DNS_CACHE_TTL,
+    )
+    # NSESession owns the cookies; a real jar would store every Set-Cookie
+    # and send those instead of the Cookie header we build
+    app['session'] = aiohttp.ClientSession(
+        connector=connector,
+        cookie_jar=aiohttp.DummyCookieJar(),
+    )
+
+
+async def on_cleanup(app):
+    """Close the shared upstream client session."""
+    await app['session'].close()
+
+
+def create_app():
+    """Build the proxy application and register its routes."""
+    app = web.Application(middlewares=[cors_middleware])
+
+    app.router.add_get('/api/nse/quote', handle_stock_quote)
+    app.router.add_get('/api/nse/quotes', handle_stock_quotes)
+    app.router.add_get('/api/nse/symbols', handle_symbols)
+    app.router.add_get('/api/nse/market-status', handle_market_status)
+    app.router.add_get('/api/nse/top-stocks', handle_top_stocks)
+    app.router.add_get('/api/health', handle_health)
+
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
 
 def run_server(port=3001):
     """Run the proxy server."""
-    server_address = ('', port)
-    httpd = HTTPServer(server_address, NSEProxyHandler)
-    
-    logger.info(f"🚀 NSE Proxy Server starting on http://localhost:{port}")
-    logger.info(f"📊 Available endpoints:")
-    logger.info(f"   GET /api/nse/quote?symbol=SYMBOL")
-    logger.info(f"   GET /api/nse/symbols")
-    logger.info(f"   GET /api/nse/market-status")
-    logger.info(f"   GET /api/nse/top-stocks")
-    logger.info(f"   GET /api/health")
-    
+    listener = configure_logging()
+
+    logger.info("🚀 NSE Proxy Server starting on http://localhost:%s", port)
+    logger.info("📊 Available endpoints:")
+    logger.info("   GET /api/nse/quote?symbol=SYMBOL")
+    logger.info("   GET /api/nse/quotes?symbols=SYMBOL1,SYMBOL2")
+    logger.info("   GET /api/nse/symbols")
+    logger.info("   GET /api/nse/market-status")
+    logger.info("   GET /api/nse/top-stocks")
+    logger.info("   GET /api/health")
+
     try:
-        httpd.serve_forever()
-    except KeyboardInterrupt:
-        logger.info('\n🛑 Shutting down proxy server...')
-        httpd.shutdown()
+        web.run_app(app=create_app(), port=port, print=None)
+        logger.info('🛑 Shutting down proxy server...')
+    finally:
+        listener.stop()
+
 
 if __name__ == '__main__':
-    run_server()
\ No newline at end of file
+    run_server()